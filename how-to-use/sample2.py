@@ -25,29 +25,30 @@ backend = connector()
 # ✅ Applies independent random Pauli gates per qubit before and after the base logic
 # ✅ Uses remove_final_measurements() to cleanly insert logic into the composed circuit
 # ✅ Re-applies measurements after twirling to preserve expected output
+# ✅ Pauli slots cost no extra physical gates when identity: Z part is a virtual rz,
+#    X part is an x gate only where one was drawn (one template per drawn X pattern)
 ################################################################################################
-import random
 import numpy as np
-from qiskit import QuantumCircuit, transpile
+from qiskit import QuantumCircuit, transpile, qpy
+from qiskit.circuit import ParameterVector
 from qiskit_ibm_runtime import SamplerV2 as Sampler, Session
 from datetime import datetime
 import time
 import sys
-from collections import Counter
+import heapq
+import math
+import os
+import hashlib
 from qiskit.visualization import circuit_drawer, plot_histogram
 from IPython.display import display, Markdown
 import matplotlib.pyplot as plt
 
-##############
-# Pauli Gates 
-##############
+##############################################################
+# Pauli Gates as X/Z parts:  P ~ X^x . Z^z  (up to phase)
+##############################################################
 paulis = ['I', 'X', 'Y', 'Z']
-pauli_gates = {
-    'I': lambda qc, q: None,
-    'X': lambda qc, q: qc.x(q),
-    'Y': lambda qc, q: qc.y(q),
-    'Z': lambda qc, q: qc.z(q)
-}
+pauli_x = np.array([0, 1, 1, 0])  # X part: a fixed x gate in the template
+pauli_z = np.array([0, 0, 1, 1])  # Z part: bound into a virtual rz(pi * z)
 
 ######################################
 # Check if running on Jupyter Notebook
@@ -67,19 +68,48 @@ def job_clear():
     sys.stdout.write('\r' + ' ' * 40 + '\r')
     sys.stdout.flush()
 
+#########################################
+# Adaptive job polling (backoff)::
+#########################################
+def wait_for_job(job, on_tick=None, tick=0.1, first_poll=0.5, max_poll=15.0, factor=1.5):
+    """
+    Block until the job is done, checking its status with exponential backoff.
+    Args:
+        job: Runtime job returned by the sampler.
+        on_tick (callable): Optional display refresh, called every `tick` seconds.
+        tick (float): Display refresh interval in seconds.
+        first_poll (float): First job.done() interval in seconds.
+        max_poll (float): Upper bound for the job.done() interval in seconds.
+        factor (float): Growth factor applied to the interval after every poll.
+    """
+    interval = first_poll
+    next_poll = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= next_poll:
+            # Only this branch talks to the service; the display ticks are local:
+            if job.done():
+                return
+            next_poll = now + interval
+            interval = min(interval * factor, max_poll)
+        if on_tick:
+            on_tick()
+        time.sleep(tick)
+
 ###########################
 # Job in progress detector::
 ###########################
 def job_inprogress():
     spinner = ['|', '/', '-', '\\']
     idx = 0
-    print("Waiting for job to queue... ", end='', flush=True)
-    while not job.done():
+    def spin():
+        nonlocal idx
         sys.stdout.write(spinner[idx % len(spinner)])
         sys.stdout.flush()
-        time.sleep(0.1)
-        sys.stdout.write('\b') 
+        sys.stdout.write('\b')
         idx += 1
+    print("Waiting for job to queue... ", end='', flush=True)
+    wait_for_job(job, on_tick=spin)
     job_clear() 
     print("✅ Job successfully processed!           ")
 
@@ -131,53 +161,235 @@ def base_circuit():
 #########################################################################################
 # Randomized Pauli-wrapped circuit for depolarizing: [Pauli twirling: Depolarizing noise]
 #########################################################################################
-def randomize_circuit(base_qc, p):
+def twirl_template(base_qc, x_mask):
     """
-    Create a randomized circuit by applying Pauli gates before and after the base circuit.
+    Create one parameterized circuit with a Pauli slot on every qubit before and after
+    the base circuit. A slot is rz(parameter) for the Z part, followed by an x gate where
+    x_mask is set. The rz is virtual on hardware, so identity slots add no physical gates.
     Args:
         base_qc (QuantumCircuit): The base quantum circuit to randomize.
-        p (float): Probability of applying a non-identity Pauli gate.
+        x_mask (np.ndarray): 2 * num_qubits flags [before | after] marking X parts.
     Returns:
-        QuantumCircuit: The randomized quantum circuit.
+        QuantumCircuit: The parameterized twirling template.
     """
-    qc = QuantumCircuit(2, 2)
-    for q in range(2):
-        pauli_before = random.choice(paulis[1:]) if np.random.rand() < p else 'I'
-        pauli_gates[pauli_before](qc, q)
+    n = base_qc.num_qubits
+    phi = ParameterVector("pauli_z", 2 * n)  # [before: 1 angle per qubit | after: 1 angle per qubit]
+    qc = QuantumCircuit(n, n)
+    for q in range(n):
+        qc.rz(phi[q], q)
+        if x_mask[q]:
+            qc.x(q)
     qc.compose(base_qc.remove_final_measurements(inplace=False), inplace=True)
-    for q in range(2):
-        pauli_after = random.choice(paulis[1:]) if np.random.rand() < p else 'I'
-        pauli_gates[pauli_after](qc, q)
-        qc.measure(q, q)
+    for q in range(n):
+        qc.rz(phi[n + q], q)
+        if x_mask[n + q]:
+            qc.x(q)
+    qc.measure(range(n), range(n))
     return qc
 
+def twirl_pubs(base_qc, num_randomizations, p, rng=None):
+    """
+    Draw Pauli assignments for all randomizations at once with NumPy and group them
+    by X pattern: one template per pattern, Z parts passed as its parameter bindings.
+    Args:
+        base_qc (QuantumCircuit): The base quantum circuit to randomize.
+        num_randomizations (int): Number of randomized instances to generate.
+        p (float): Probability of applying a non-identity Pauli gate.
+        rng (np.random.Generator): Optional random generator.
+    Returns:
+        list[tuple[QuantumCircuit, np.ndarray]]: (template, rz angles of shape (k, 2 * num_qubits)).
+    """
+    rng = rng or np.random.default_rng()
+    shape = (num_randomizations, 2 * base_qc.num_qubits)
+    choice = np.where(rng.random(shape) < p, rng.integers(1, len(paulis), size=shape), 0)
+    x_masks, group = np.unique(pauli_x[choice], axis=0, return_inverse=True)
+    angles = np.pi * pauli_z[choice]
+    return [(twirl_template(base_qc, mask), angles[group.ravel() == i])
+            for i, mask in enumerate(x_masks)]
+
+#########################################################################################
+# Transpile cache keyed by circuit structure + backend target (memory + optional disk):
+#########################################################################################
+transpile_cache = {}
+
+def circuit_key(circ):
+    """
+    Build a key from the shape and gate sequence of a circuit that is stable across runs.
+    Parameters are keyed by name and the auto-generated circuit name is left out (qpy would
+    serialize it), so the same twirl template gets the same key on every run.
+    Args:
+        circ (QuantumCircuit): The circuit to fingerprint.
+    Returns:
+        tuple: Width, register layout, global phase, then every operation with its
+        parameters and qubit/clbit indices, in order.
+    """
+    shape = (
+        circ.num_qubits,
+        circ.num_clbits,
+        tuple((reg.name, reg.size) for reg in circ.qregs),
+        tuple((reg.name, reg.size) for reg in circ.cregs),
+        str(circ.global_phase),
+    )
+    ops = tuple(
+        (inst.operation.name,
+         tuple(str(param) for param in inst.operation.params),
+         tuple(circ.find_bit(q).index for q in inst.qubits),
+         tuple(circ.find_bit(c).index for c in inst.clbits))
+        for inst in circ.data
+    )
+    return shape + ops
+
+def cached_transpile(circuit_list, backend, optimization_level=3, cache_dir=None):
+    """
+    Transpile circuits, reusing earlier results for structurally identical circuits.
+    The in-memory tier lives for this run; with cache_dir set, results are also kept as
+    qpy files there, so the twirl templates (at most 4^n X patterns) are reused by later runs.
+    Args:
+        circuit_list (list[QuantumCircuit]): Circuits to transpile.
+        backend: Backend returned by the Qiskit Connector.
+        optimization_level (int): Transpiler optimization level.
+        cache_dir (str): Optional directory for the on-disk tier.
+    Returns:
+        list[QuantumCircuit]: Transpiled circuits, in input order.
+    """
+    target = (backend.name, str(getattr(backend, "backend_version", None)), optimization_level)
+    keys = [hashlib.sha256(repr((circuit_key(c), target)).encode()).hexdigest() for c in circuit_list]
+    cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+    missing = {}
+    for key, circ in zip(keys, circuit_list):
+        if key in transpile_cache:
+            continue
+        path = os.path.join(cache_dir, f"{key}.qpy") if cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as fh:
+                    transpile_cache[key] = qpy.load(fh)[0]
+                continue
+            except Exception:
+                pass  # Unreadable cache entry: transpile again and overwrite it.
+        missing.setdefault(key, circ)
+    if missing:
+        # Only the unseen structures reach the (parallel) transpiler:
+        done = transpile(list(missing.values()), backend=backend, optimization_level=optimization_level)
+        for key, circ_t in zip(missing, done):
+            transpile_cache[key] = circ_t
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                path = os.path.join(cache_dir, f"{key}.qpy")
+                with open(f"{path}.{os.getpid()}.tmp", "wb") as fh:
+                    qpy.dump(circ_t, fh)
+                os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return [transpile_cache[key] for key in keys]
+
+############################################
+# Streaming Job Result Aggregation
+############################################
+def aggregate_counts(results, creg="c"):
+    """
+    Accumulate measurement counts of all pubs as sparse (outcomes, counts) arrays.
+    Memory grows with the distinct outcomes seen, not with the register width.
+    Args:
+        results: Sampler job result (iterable of pub results).
+        creg (str): Name of the classical register to aggregate.
+    Returns:
+        tuple[np.ndarray, np.ndarray, int]: Outcomes (packed big-endian shot bytes),
+        their counts, and the register width (0 when there are no pubs).
+    Raises:
+        ValueError: If the register width differs between pubs.
+    """
+    outcomes, counts, num_bits = None, None, None
+    for pub in results:
+        bits = getattr(pub.data, creg)
+        if num_bits is None:
+            num_bits = bits.num_bits
+        elif bits.num_bits != num_bits:
+            raise ValueError(f"Register '{creg}' is {bits.num_bits} bits wide in one pub and {num_bits} in another.")
+        # One opaque fixed-size key per shot; works for any register width:
+        raw = np.ascontiguousarray(bits.array.reshape(-1, bits.array.shape[-1]))
+        shots = raw.view(np.dtype((np.void, raw.shape[-1]))).ravel()
+        keys, hits = np.unique(shots, return_counts=True)
+        if outcomes is not None:
+            keys, merged = np.unique(np.concatenate([outcomes, keys]), return_inverse=True)
+            totals = np.zeros(len(keys), dtype=np.int64)
+            np.add.at(totals, merged.ravel(), np.concatenate([counts, hits]))
+            hits = totals
+        outcomes, counts = keys, hits
+    if outcomes is None:
+        return np.empty(0, dtype=np.void), np.zeros(0, dtype=np.int64), 0
+    return outcomes, counts, num_bits
+
+def counts_to_dict(outcomes, counts, num_bits):
+    """
+    Convert aggregated counts to the usual {bitstring: count} form.
+    Args:
+        outcomes (np.ndarray): Packed outcomes from aggregate_counts().
+        counts (np.ndarray): Counts matching the outcomes.
+        num_bits (int): Classical register width.
+    Returns:
+        dict: Bitstring counts.
+    """
+    return {format(int.from_bytes(key.tobytes(), "big"), f"0{num_bits}b"): int(count)
+            for key, count in zip(outcomes, counts)}
+
 ############################################
 # Job Result Histogram / Presentation
 ############################################
-def console_histogram(count_data, max_width=50):
-    max_count = max(count_data.values())
+def console_histogram(count_data, max_width=50, top_k=16, log_scale=False, bucket_bits=None):
+    """
+    Print a bounded text histogram: at most top_k bars plus one summary line.
+    Args:
+        count_data (dict): Bitstring counts.
+        max_width (int): Width of the longest bar in characters.
+        top_k (int): Number of most frequent outcomes (or buckets) to draw, at least 1
+            (heap selection, O(n log k)).
+        log_scale (bool): Scale bars by log(1 + count) instead of count.
+        bucket_bits (int): Optional; group outcomes by their leftmost bucket_bits bits and
+            draw one bar per bucket (labelled like "01***") instead of one per outcome.
+    Raises:
+        ValueError: If top_k is smaller than 1.
+    """
+    if top_k < 1:
+        raise ValueError(f"top_k must be at least 1, got {top_k}.")
+    if not count_data:
+        return
+    if bucket_bits is not None:
+        buckets = {}
+        for bitstring, count in count_data.items():
+            label = bitstring[:bucket_bits] + '*' * (len(bitstring) - len(bitstring[:bucket_bits]))
+            buckets[label] = buckets.get(label, 0) + count
+        count_data = buckets
+    top = heapq.nlargest(top_k, count_data.items(), key=lambda kv: kv[1])
+    weight = math.log1p if log_scale else float
+    max_count = weight(top[0][1])
     scale = max_width / max_count if max_count > 0 else 1
 
     print()
-    for bitstring, count in sorted(count_data.items()):
-        bar = '█' * int(count * scale)
+    for bitstring, count in sorted(top):
+        bar = '█' * int(weight(count) * scale)
         print(f"{bitstring:>5} | {bar} {count}")
+    hidden = len(count_data) - len(top)
+    if hidden > 0:
+        rest = sum(count_data.values()) - sum(count for _, count in top)
+        kind = "buckets" if bucket_bits is not None else "outcomes"
+        print(f"{'...':>5} | {hidden} more {kind}, {rest} counts")
 
 ##################################################################################
 # Shots, Range & Probability settings::  
 ##################################################################################
-rand_range = 4  # Number of randomized circuits to generate - minimum is 3.
+rand_range = 4  # Number of randomizations (bindings across twirl templates) to generate - minimum is 3.
 shots = 4096    # The more the shots, the better the statistics of data. 
 p = 0.1         # Probability of applying a non-identity Pauli gate.(Pauli twirling)
+transpile_cache_dir = None  # e.g. "~/.cache/qiskit-connector/transpile" to reuse transpiled templates across runs.
 qc = base_circuit()
-circuits = [randomize_circuit(qc, p) for _ in range(rand_range)]
+twirls = twirl_pubs(qc, rand_range, p)
+circuits = [template for template, _ in twirls]
 
 ######################
 # # Randomized circuit drawing:
 ######################
 def platform(circuit_list):
     for i, circ in enumerate(circuit_list):
-        render = f"\n🔧 Entangled Randomized Circuit with Depolarizing Noise & Pauli Gates: Circuit Pub {i+1}"
+        render = f"\n🔧 Entangled Pauli-Twirl Template (Z slots bound per randomization): Circuit Pub {i+1}"
         if in_jupyter():
             display(Markdown(f"{render}"))
             display(circ.draw(output="mpl"))
@@ -191,17 +403,23 @@ def platform(circuit_list):
 ##################################################################################
 try:
     try:
-        qc_t = [transpile(c, backend=backend, optimization_level=3) for c in circuits[:rand_range]]
+        # Each twirl template is transpiled once (batched over a process pool, or loaded from
+        # the transpile cache); its randomizations are parameter bindings of a single pub:
+        qc_t = cached_transpile(circuits, backend, optimization_level=3, cache_dir=transpile_cache_dir)
+        # Slots right before a measurement can be dropped by the transpiler (a Z there does
+        # not change counts), so bind only the parameters each transpiled template kept:
+        pubs = [(circ_t, angles[:, [param.index for param in circ_t.parameters]])
+                for circ_t, (_, angles) in zip(qc_t, twirls)]
         if current == "Open Plan":
             sampler = Sampler(mode=backend)  # Session not allowed in Open Plan
-            job = sampler.run(qc_t, shots=shots)
+            job = sampler.run(pubs, shots=shots)
             platform(circuits)
             print("ok")
             job_inprogress()
         elif current == "Paid Plan":
             with Session(backend=backend.name) as session:
                 sampler = Sampler(mode=session) # Session allowed in Paid Plan
-                job = sampler.run(qc_t, shots=shots)
+                job = sampler.run(pubs, shots=shots)
                 platform(circuits)
                 print("ok")
                 job_inprogress()
@@ -218,22 +436,23 @@ except KeyboardInterrupt:
 
 # Job Sent::
 def job_sent():
-    elapsed = 0
     try:
         print(f"-- REAL BACKEND JOB INFORMATION --")
         print(f"Backend Job ID: {job.job_id()}")
         print(f"Assigned Backend QPU: {backend.name}")
         print(f"Number of circuit pubs submitted to backend job: {len(circuits)}")
+        print(f"Pauli-twirl randomizations across pubs: {rand_range}")
         completion_status = job.status().capitalize()
         if completion_status == "Done": 
             job_status = "Completed"
         else: 
             job_status = "Pending"
         print(f"Job Status: {job_status}")
-        while not job.done():
+        start = time.monotonic()
+        def queue_time():
+            elapsed = int(time.monotonic() - start)
             print(f"\r⏳ Job queue time... {elapsed} sec", end="", flush=True)
-            time.sleep(1)
-            elapsed += 1
+        wait_for_job(job, on_tick=queue_time, tick=1.0)
     except KeyboardInterrupt:
         print("\n⛔ Job interrupted with keyboard while waiting!")
         print("⛔ You pressed Ctrl+C or Command+C, exiting gracefully.")
@@ -244,10 +463,8 @@ def job_sent():
 # Job Result::
 job_sent()
 results = job.result()
-pubs_total = Counter()
-for pub in results:
-    pubs = pub.data.c.get_counts()
-    pubs_total.update(pubs)
+outcomes, counts, num_bits = aggregate_counts(results)
+pubs_total = counts_to_dict(outcomes, counts, num_bits)
 print("______________________________________________________________________________")
 print(f"✅ Job Result:")
 print(f"Result Data: {dict(pubs_total)}")